@@ -2,15 +2,161 @@
 
 import os
 import sys
+import argparse
+import ast
+import asyncio
 import subprocess
 import re
 import json
+import functools
+import logging
+import shutil
+import tempfile
+import glob
+import hashlib
+import multiprocessing
 
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
+
+try:
+    import orjson  # Optional: faster validation of large, valid files
+except ImportError:
+    orjson = None
+
+try:
+    import regex  # Optional: native timeouts for LLM-supplied regex fixes
+except ImportError:
+    regex = None
+
+try:
+    import h2  # noqa: F401  # Optional: lets httpx speak HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+log = logging.getLogger(__name__)
 
 # Make sure OPENAI_API_KEY is set in your environment:
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def create_client():
+    """
+    Creates an OpenAI client for one run. Its connection pool keeps TLS
+    sessions to the API alive across fix iterations and files; use it as
+    `async with create_client() as client:` so the pool is closed when the
+    run ends.
+    """
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=DefaultAsyncHttpxClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=16, keepalive_expiry=60),
+        ),
+    )
+
+# Fixes start with the small model and escalate to the large one after
+# ESCALATE_AFTER failed attempts
+SMALL_MODEL = "gpt-4o-mini"
+LARGE_MODEL = "gpt-4o"
+ESCALATE_AFTER = 2
+
+# Completion token limit of both models
+MAX_OUTPUT_TOKENS = 16384
+
+SYSTEM_PROMPT = (
+    "You are an assistant that fixes JSON syntax errors (or Python syntax errors) "
+    "when JSON is accidentally run as Python. "
+    "You must respond with a valid JSON containing the fix instructions. "
+    "Respond with the raw JSON object only, without markdown fences. "
+    "Do not add extra keys."
+)
+
+# Longer payloads (file content, LLM responses) are shortened in log output
+LOG_PREVIEW_CHARS = 2000
+
+# Seconds a regex fix may run before it is rejected (catastrophic backtracking)
+REGEX_TIMEOUT = 2.0
+REGEX_STARTUP_TIMEOUT = 30.0
+_PATTERN_ERRORS = (re.error, regex.error) if regex is not None else (re.error,)
+
+# Set once jsonlint-php turns out not to be installed
+_jsonlint_missing = False
+
+# Larger files skip the Python syntax check; the JSON error is enough
+PYTHON_CHECK_MAX_SIZE = 64 * 1024
+
+# Characters of content shown on each side of a JSON parse error
+ERROR_CONTEXT_CHARS = 80
+
+# Lines sent on each side of the error line; whole-file prompts are only
+# used after FULL_FILE_AFTER failed attempts. Windows of long lines (e.g.
+# minified JSON) are cut to ERROR_WINDOW_CHARS on each side of the error.
+ERROR_WINDOW_LINES = 10
+ERROR_WINDOW_CHARS = 2000
+FULL_FILE_AFTER = 3
+_ERROR_LINE = re.compile(r'line (\d+)(?:, col(?:umn)? (\d+))?')
+
+# On-disk cache of fix suggestions, one file per key; None disables it
+_cache_dir = os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "llm-json-fixer"
+)
+CACHE_MAX_ENTRIES = 1000
+
+
+class _Preview:
+    """
+    Wraps a log argument so it is only truncated (to LOG_PREVIEW_CHARS) when
+    the record is actually formatted, i.e. never for disabled levels.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        if len(self.text) <= LOG_PREVIEW_CHARS:
+            return self.text
+        return f"{self.text[:LOG_PREVIEW_CHARS]} ... ({len(self.text)} chars)"
+
+
+class _CliFormatter(logging.Formatter):
+    """
+    Formats records as their bare message for the command line, with debug
+    records marked "[Debug] ".
+    """
+
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno == logging.DEBUG:
+            return f"[Debug] {message}"
+        return message
+
+
+def read_file(file_path):
+    """
+    Returns the text content of file_path.
+    """
+    with open(file_path, "r") as f:
+        return f.read()
+
+
+def write_file_atomic(file_path, content):
+    """
+    Writes content to file_path through a temporary file and os.replace, so
+    the file is never left half-written.
+    """
+    tmp_path = file_path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        # Don't leave a stale temporary file next to the original
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
 def strip_markdown_fences(text):
@@ -31,83 +177,291 @@ def strip_markdown_fences(text):
     """
     # Trim whitespace
     text = text.strip()
+    # JSON mode responses come without fences
+    if text.startswith("{"):
+        return text
     # Remove any leading triple backticks with optional language
-    text = re.sub(r'^```[a-zA-Z0-9]*\n?', '', text)
+    if text.startswith("```"):
+        newline = text.find("\n")
+        if newline != -1:
+            text = text[newline + 1:]
+        else:
+            # Single-line block: skip the fence and its language tag
+            text = re.sub(r'^```[a-zA-Z0-9]*', '', text)
     # Remove any trailing triple backticks
-    text = re.sub(r'```$', '', text)
+    if text.endswith("```"):
+        text = text[:-3]
     return text.strip()
 
 
-def run_jsonlint(file_path):
+@functools.lru_cache(maxsize=64)
+def compile_fix_pattern(pattern):
+    """
+    Compiles a regex pattern suggested by the LLM, with the regex module
+    when it is installed. Raises re.error (or regex.error) if it is invalid.
+    Cached by pattern string so repeated suggestions are only compiled once.
+    """
+    if regex is not None:
+        return regex.compile(pattern)
+    return re.compile(pattern)
+
+
+def _substitute_worker(compiled, replacement, content, conn):
+    # Signal start-up is done, so only the substitution itself is timed
+    conn.send(None)
+    try:
+        conn.send((True, compiled.sub(replacement, content)))
+    except Exception as e:
+        conn.send((False, str(e)))
+    conn.close()
+
+
+def substitute_with_timeout(compiled, replacement, content, timeout=REGEX_TIMEOUT):
+    """
+    Returns compiled.sub(replacement, content), raising TimeoutError if it
+    runs longer than timeout seconds.
+    The regex module supports the timeout natively. The re module holds the
+    GIL while matching, so a thread can't be abandoned; the substitution
+    runs in a child process instead, which is killed on timeout. The child
+    is started with forkserver/spawn, since this runs in a worker thread and
+    forking a multi-threaded process is unsafe.
+    Raises re.error if the substitution fails in the child.
     """
-    Runs jsonlint-php on the given file_path.
+    if regex is not None:
+        return compiled.sub(replacement, content, timeout=timeout)
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+    receiver, sender = context.Pipe(duplex=False)
+    worker = context.Process(
+        target=_substitute_worker,
+        args=(compiled, replacement, content, sender),
+        daemon=True,
+    )
+    worker.start()
+    sender.close()
+    try:
+        # The child re-imports this module first, which isn't the regex's fault
+        if not receiver.poll(REGEX_STARTUP_TIMEOUT):
+            worker.terminate()
+            raise TimeoutError("regex worker process did not start")
+        receiver.recv()
+        if not receiver.poll(timeout):
+            worker.terminate()
+            raise TimeoutError(f"regex substitution took longer than {timeout}s")
+        ok, result = receiver.recv()
+    except EOFError:
+        # The child died without reporting a result
+        raise re.error("regex worker process exited unexpectedly")
+    finally:
+        worker.join()
+        receiver.close()
+    if not ok:
+        raise re.error(result)
+    return result
+
+
+def run_jsonlint(file_path, content):
+    """
+    Checks JSON validity of content (the text of file_path) with Python's
+    built-in parser first. Only when it is invalid is jsonlint-php run on
+    file_path, for its more readable error report.
     Returns (is_valid, lint_output).
     """
-    print("[Debug] Checking JSON validity with jsonlint-php fallback to Python...")
+    global _jsonlint_missing
+
+    log.debug("Checking JSON validity with Python, jsonlint-php on error...")
+    is_valid, py_output = check_json_via_python(content)
+    if is_valid or _jsonlint_missing:
+        return is_valid, py_output
+
     try:
-        proc = subprocess.Popen(
+        proc = subprocess.run(
             ["jsonlint-php", file_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
+            capture_output=True,
+            text=True,
+            timeout=5
         )
-        stdout, _ = proc.communicate()
-        stdout = stdout.strip()
-        print("[Debug] jsonlint-php output:", stdout)
+    except FileNotFoundError:
+        # Remember so later iterations don't try to spawn it again
+        _jsonlint_missing = True
+        return is_valid, py_output
+    except subprocess.TimeoutExpired:
+        log.warning("[!] jsonlint-php timed out, using Python's error output.")
+        return is_valid, py_output
 
-        if "Valid JSON" in stdout:
-            return True, stdout
-        else:
-            return False, stdout
+    stdout = (proc.stdout + proc.stderr).strip()
+    log.debug("jsonlint-php output: %s", _Preview(stdout))
 
-    except FileNotFoundError:
-        # Fallback to Python's built-in check
-        return check_json_via_python(file_path)
+    # Python already rejected the file; keep its message if jsonlint-php
+    # has nothing more useful to say
+    if not stdout or "Valid JSON" in stdout:
+        return False, py_output
+    return False, stdout
 
 
-def check_json_via_python(file_path):
+@functools.lru_cache(maxsize=32)
+def check_json_via_python(content):
     """
-    Fallback check if jsonlint-php is not installed.
+    Validates content with orjson when it is installed, and with Python's
+    built-in JSON parser otherwise or to locate an error orjson reported.
+    Memoized, so content seen again within a run (another file with the
+    same content, or a fix that restores an earlier state) is not parsed
+    twice.
     Returns (is_valid, error_message).
     """
+    if orjson is not None:
+        try:
+            orjson.loads(content)
+            return True, "Valid JSON (orjson)"
+        except orjson.JSONDecodeError:
+            pass  # Re-parse below for the line/column of the error
+
     try:
-        with open(file_path, "r") as f:
-            data = json.load(f)  # Attempt parse
+        json.loads(content)  # Attempt parse
         return True, "Valid JSON (Python builtin)"
     except json.JSONDecodeError as e:
-        msg = f"JSONDecodeError: {e.msg} at line {e.lineno}, column {e.colno}"
-        print("[Debug] Python JSON parse error ->", msg)
+        snippet = content[max(0, e.pos - ERROR_CONTEXT_CHARS):e.pos + ERROR_CONTEXT_CHARS]
+        msg = (
+            f"JSONDecodeError: {e.msg} at line {e.lineno}, column {e.colno}\n"
+            f"Context around the error:\n{snippet}"
+        )
+        log.debug("Python JSON parse error -> %s", msg)
         return False, msg
 
 
-def simulate_python_execution(file_path):
+def simulate_python_execution(content, file_path):
+    """
+    Attempt to parse content as Python to mimic a user accidentally running
+    'python file.json'. Only the syntax tree is built, no bytecode.
+    Returns (bool, str).
+    """
+    log.debug("Checking %s for Python SyntaxError by ast.parse()...", file_path)
+    is_valid, error_output = _python_syntax_check(content)
+    if is_valid:
+        log.debug("No Python syntax error.")
+    else:
+        log.debug("Caught Python SyntaxError -> %s", error_output)
+    return is_valid, error_output
+
+
+@functools.lru_cache(maxsize=32)
+def _python_syntax_check(content):
     """
-    Attempt to compile the file as Python to mimic a user accidentally running
-    'python file.json'.
+    The ast.parse() check behind simulate_python_execution. Memoized on the
+    content alone like check_json_via_python, so copies of one file share
+    the result.
     Returns (bool, str).
     """
-    print("[Debug] Checking for Python SyntaxError by compile()...")
     try:
-        with open(file_path, "r") as f:
-            content = f.read()
-        compile(content, file_path, 'exec')
-        print("[Debug] No Python syntax error.")
+        ast.parse(content)
         return True, "No SyntaxError"
     except SyntaxError as e:
-        error_output = (
+        return False, (
             f"SyntaxError: {e.msg} at line {e.lineno}, col {e.offset}\n"
             f"Offending code: {e.text.strip() if e.text else ''}"
         )
-        print("[Debug] Caught Python SyntaxError ->", error_output)
-        return False, error_output
 
 
-def call_openai_for_fix(error_output, current_content):
+def error_window(current_content, error_output):
     """
-    Calls the OpenAI API with the error message to get a suggested fix,
-    using the client.chat.completions.create(...) structure.
+    Returns (first_line, last_line, total_lines, text, cut) for the lines of
+    current_content within ERROR_WINDOW_LINES of the first line number
+    mentioned in error_output, or None if it mentions none.
+    If those lines are longer than 2 * ERROR_WINDOW_CHARS, text is cut to
+    ERROR_WINDOW_CHARS on each side of the error column and cut is True.
     """
-    prompt = f"""
+    match = _ERROR_LINE.search(error_output)
+    if not match:
+        return None
+    lineno = int(match.group(1))
+    lines = current_content.splitlines(keepends=True)
+    first = max(0, lineno - 1 - ERROR_WINDOW_LINES)
+    last = min(len(lines), lineno + ERROR_WINDOW_LINES)
+    text = "".join(lines[first:last])
+    if len(text) <= 2 * ERROR_WINDOW_CHARS:
+        return first + 1, last, len(lines), text, False
+
+    column = int(match.group(2)) if match.group(2) else 1
+    pos = sum(len(line) for line in lines[first:lineno - 1]) + column - 1
+    pos = min(max(pos, 0), len(text))
+    start = max(0, pos - ERROR_WINDOW_CHARS)
+    end = min(len(text), pos + ERROR_WINDOW_CHARS)
+    return (first + 1 + text.count("\n", 0, start),
+            first + 1 + text.count("\n", 0, end - 1),
+            len(lines), text[start:end], True)
+
+
+def build_fix_messages(error_output, current_content, window=None,
+                       allow_replacement=True):
+    """
+    Builds the chat messages asking the LLM for a fix of current_content.
+    With a window (see error_window) only those lines are sent and a regex
+    fix is required; otherwise the whole file is sent, and a whole-file
+    replacement is offered unless allow_replacement is False.
+    Shared by the synchronous and the batch code paths.
+    """
+    if window:
+        first, last, total, text, cut = window
+        where = "cut to the characters around the error" if cut else "around the error"
+        prompt = f"""
+We have a JSON file that might be invalid JSON or might have caused
+a Python SyntaxError if someone tried to run it directly as Python code.
+
+Error output:
+---
+{error_output}
+---
+
+The file has {total} lines ({len(current_content)} characters).
+Lines {first}-{last} of {total}, {where}:
+---
+{text}
+---
+
+Please provide a concise regex fix in JSON form. The pattern is applied to
+the whole file with re.sub, so make it specific enough to match only the
+broken text shown above. Format:
+
+{{
+  "regex_pattern": "some pattern",
+  "replacement": "some replacement",
+  "explanation": "one line explanation"
+}}
+
+Return valid JSON with these keys. Do not wrap your answer with extra text.
+"""
+    elif not allow_replacement:
+        prompt = f"""
+We have a JSON file that might be invalid JSON or might have caused
+a Python SyntaxError if someone tried to run it directly as Python code.
+
+Error output:
+---
+{error_output}
+---
+
+The current content of the JSON file is:
+---
+{current_content}
+---
+
+The file is too large to return in full, so please provide a concise regex
+fix in JSON form. The pattern is applied to the whole file with re.sub.
+Format:
+
+{{
+  "regex_pattern": "some pattern",
+  "replacement": "some replacement",
+  "explanation": "one line explanation"
+}}
+
+Return valid JSON with these keys. Do not wrap your answer with extra text.
+"""
+    else:
+        prompt = f"""
 We have a JSON file that might be invalid JSON or might have caused
 a Python SyntaxError if someone tried to run it directly as Python code.
 
@@ -139,48 +493,205 @@ If you prefer to provide a direct updated JSON snippet, use:
 Return valid JSON with these keys. Do not wrap your answer with extra text.
 """
 
-    print("[Debug] Sending prompt to OpenAI:\n", prompt)
-
-    chat_completion = client.chat.completions.create(
-        model="gpt-4o",  # Replace "gpt-4o" with a standard model if needed
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are an assistant that fixes JSON syntax errors (or Python syntax errors) "
-                    "when JSON is accidentally run as Python. "
-                    "You must respond with a valid JSON containing the fix instructions. "
-                    "Do not add extra keys."
-                ),
-            },
-            {"role": "user", "content": prompt},
-        ],
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def content_hash_of(content):
+    """
+    Returns the sha256 hex digest of content.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def fix_cache_key(error_output, content_hash, model=SMALL_MODEL, full_file=False):
+    """
+    Returns the cache key identifying a fix request for the content whose
+    hash (see content_hash_of) is content_hash.
+    """
+    mode = "full" if full_file else "window"
+    return hashlib.sha256(
+        (model + "\x00" + mode + "\x00" + error_output + "\x00" + content_hash)
+        .encode("utf-8")
+    ).hexdigest()
+
+
+def load_cached_fix(key):
+    """
+    Returns the cached fix suggestion for key, or None on a miss.
+    """
+    if _cache_dir is None:
+        return None
+    path = os.path.join(_cache_dir, key)
+    try:
+        with open(path, "r") as f:
+            fix_suggestion = f.read()
+        # Mark as recently used so eviction drops the oldest entries first
+        os.utime(path)
+    except OSError:
+        # Missing, or evicted by a concurrent writer just now
+        return None
+    return fix_suggestion
+
+
+def store_cached_fix(key, fix_suggestion):
+    """
+    Stores a fix suggestion under key, evicting the least recently used
+    entries once the cache holds more than CACHE_MAX_ENTRIES.
+    """
+    if _cache_dir is None:
+        return
+    try:
+        os.makedirs(_cache_dir, exist_ok=True)
+        # Write through a temporary file so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=_cache_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(fix_suggestion)
+            os.replace(tmp_path, os.path.join(_cache_dir, key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        entries = []
+        for entry in os.scandir(_cache_dir):
+            if entry.name.startswith("."):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+        if len(entries) > CACHE_MAX_ENTRIES:
+            entries.sort()
+            for _, path in entries[:len(entries) - CACHE_MAX_ENTRIES]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # Evicted by a concurrent writer
+    except OSError as e:
+        log.warning("[!] Could not write the fix cache: %s", e)
+
+
+def is_cacheable_fix(fix_suggestion, finish_reason):
+    """
+    Returns whether a fix suggestion may be cached: only complete responses
+    that parse as JSON, so a cut-off answer isn't replayed on later runs.
+    """
+    if finish_reason == "length":
+        return False
+    try:
+        json.loads(fix_suggestion)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def fix_max_tokens(text, full_file=False):
+    """
+    Returns the completion token limit for a fix of text: roughly twice
+    what a full replacement would need, at least 256. Regex fixes are capped
+    at 4096; whole-file fixes only at the models' MAX_OUTPUT_TOKENS.
+    """
+    ceiling = MAX_OUTPUT_TOKENS if full_file else 4096
+    return min(ceiling, max(256, len(text) // 2))
+
+
+def build_fix_request(error_output, current_content, full_file=False):
+    """
+    Returns (messages, max_tokens) for a fix request. Unless full_file is
+    set, only a window around the error is sent when one can be located.
+    A whole-file replacement is only offered when it fits the model's
+    output limit.
+    """
+    window = None if full_file else error_window(current_content, error_output)
+    if window:
+        messages = build_fix_messages(error_output, current_content, window)
+        return messages, fix_max_tokens(window[3])
+
+    fits = len(current_content) // 2 <= MAX_OUTPUT_TOKENS
+    messages = build_fix_messages(
+        error_output, current_content, allow_replacement=fits
+    )
+    return messages, fix_max_tokens(current_content, full_file=fits)
+
+
+async def call_openai_for_fix(client, error_output, current_content, model=SMALL_MODEL,
+                              full_file=False, key=None):
+    """
+    Calls the OpenAI API with the error message to get a suggested fix,
+    using the client.chat.completions.create(...) structure.
+    The response is streamed and joined once complete.
+    Suggestions are cached on disk under key (see fix_cache_key), so an
+    identical request is answered without calling the API.
+    """
+    if key is None:
+        key = fix_cache_key(
+            error_output, content_hash_of(current_content), model, full_file
+        )
+    cached = await asyncio.to_thread(load_cached_fix, key)
+    if cached is not None:
+        log.debug("Using cached fix suggestion:\n%s", _Preview(cached))
+        return cached
+
+    messages, max_tokens = build_fix_request(error_output, current_content, full_file)
+    log.debug("Sending prompt to OpenAI (%s):\n%s",
+              model, _Preview(messages[-1]["content"]))
+
+    chat_completion = await client.chat.completions.create(
+        model=model,
+        messages=messages,
         temperature=0.2,
+        max_tokens=max_tokens,
+        response_format={"type": "json_object"},
+        stream=True,
     )
 
-    fix_suggestion = chat_completion.choices[0].message.content
-    print("[Debug] Raw OpenAI response:\n", fix_suggestion)
+    # Collect the streamed tokens as they arrive
+    chunks = []
+    finish_reason = None
+    async for chunk in chat_completion:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            chunks.append(delta)
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+
+    fix_suggestion = "".join(chunks)
+    if finish_reason == "length":
+        log.warning("[!] OpenAI response was cut off at the max_tokens limit.")
+    log.debug("Raw OpenAI response:\n%s", _Preview(fix_suggestion))
 
     # Remove any markdown fences from the returned suggestion
     fix_suggestion_clean = strip_markdown_fences(fix_suggestion)
-    print("[Debug] After stripping markdown fences:\n", fix_suggestion_clean)
+    log.debug("After stripping markdown fences:\n%s", _Preview(fix_suggestion_clean))
 
+    if is_cacheable_fix(fix_suggestion_clean, finish_reason):
+        await asyncio.to_thread(store_cached_fix, key, fix_suggestion_clean)
     return fix_suggestion_clean
 
 
-def apply_fix_to_file(fix_response, file_path):
+def apply_fix_to_file(fix_response, file_path, old_content):
     """
     Parse the fix_response as JSON. Then either apply a regex pattern
     or replace the entire file content with the 'replacement'.
+    old_content is the current content of file_path.
+    Returns (changed, content) where content is the file's new content.
     """
-    print("[Debug] Applying fix to file...")
+    log.debug("Applying fix to file...")
 
     try:
         fix_data = json.loads(fix_response)
     except json.JSONDecodeError:
-        print("[!] OpenAI returned invalid JSON in the fix suggestion.")
-        print("Full response:\n", fix_response)
-        return False
+        log.warning("[!] OpenAI returned invalid JSON in the fix suggestion.")
+        log.warning("Full response:\n%s", _Preview(fix_response))
+        return False, old_content
+
+    if not isinstance(fix_data, dict):
+        log.warning("[!] The fix suggestion is not a JSON object. No changes.")
+        return False, old_content
 
     # Potential structures:
     # {
@@ -198,102 +709,453 @@ def apply_fix_to_file(fix_response, file_path):
         pattern = fix_data["regex_pattern"]
         replacement = fix_data["replacement"]
         explanation = fix_data.get("explanation", "")
-        print(f"[Debug] Regex pattern: {pattern}")
-        print(f"[Debug] Replacement: {replacement}")
-        print(f"[Debug] Explanation: {explanation}")
+        log.debug("Regex pattern: %s", pattern)
+        log.debug("Replacement: %s", _Preview(replacement))
+        log.debug("Explanation: %s", explanation)
 
-        with open(file_path, "r") as f:
-            old_content = f.read()
+        if not isinstance(pattern, str) or not isinstance(replacement, str):
+            log.warning("[!] Regex fix fields must be strings. No changes.")
+            return False, old_content
+
+        try:
+            compiled = compile_fix_pattern(pattern)
+            new_content = substitute_with_timeout(compiled, replacement, old_content)
+        except _PATTERN_ERRORS as e:
+            log.warning("[!] Invalid regex fix (%s). No changes.", e)
+            return False, old_content
+        except TimeoutError:
+            log.warning("[!] Regex fix took longer than %ss and was rejected. No changes.",
+                        REGEX_TIMEOUT)
+            return False, old_content
 
-        new_content = re.sub(pattern, replacement, old_content)
         if new_content != old_content:
-            with open(file_path, "w") as f:
-                f.write(new_content)
-            print("[Debug] Regex fix applied successfully.")
-            return True
+            write_file_atomic(file_path, new_content)
+            log.debug("Regex fix applied successfully.")
+            return True, new_content
         else:
-            print("[!] Regex did not match anything in the file. No changes.")
-            return False
+            log.warning("[!] Regex did not match anything in the file. No changes.")
+            return False, old_content
 
     elif "replacement" in fix_data:
         replacement_text = fix_data["replacement"]
         explanation = fix_data.get("explanation", "")
-        print(f"[Debug] Full replacement fix:")
-        print(f"[Debug] Explanation: {explanation}")
+        log.debug("Full replacement fix:")
+        log.debug("Explanation: %s", explanation)
+
+        if not isinstance(replacement_text, str):
+            log.warning("[!] Replacement must be a string. No changes.")
+            return False, old_content
 
-        with open(file_path, "w") as f:
-            f.write(replacement_text)
-        print("[Debug] Replaced entire file content.")
-        return True
+        if replacement_text == old_content:
+            log.warning("[!] Replacement is identical to the current content. No changes.")
+            return False, old_content
+
+        write_file_atomic(file_path, replacement_text)
+        log.debug("Replaced entire file content.")
+        return True, replacement_text
 
     else:
-        print("[!] The fix suggestion JSON does not have the required keys.")
-        print("Full response:\n", fix_response)
-        return False
+        log.warning("[!] The fix suggestion JSON does not have the required keys.")
+        log.warning("Full response:\n%s", _Preview(fix_response))
+        return False, old_content
+
+
+def collect_errors(file_path, current_content, check_python=False):
+    """
+    Checks current_content as JSON. If it is invalid and check_python is set,
+    content no larger than PYTHON_CHECK_MAX_SIZE is also checked as Python;
+    by default the JSON error alone already pinpoints the problem.
+    Returns (is_valid, error_summary) where error_summary is the text
+    sent to the LLM.
+    """
+    is_valid, lint_output = run_jsonlint(file_path, current_content)
+    if is_valid:
+        return True, lint_output
+
+    # There's some error
+    log.debug("JSON Lint Output:\n%s", _Preview(lint_output))
+
+    py_ok = True
+    if check_python and len(current_content) <= PYTHON_CHECK_MAX_SIZE:
+        py_ok, py_error_output = simulate_python_execution(current_content, file_path)
+    if not py_ok:
+        log.debug("Python SyntaxError:\n%s", py_error_output)
+
+    # Combine error summary
+    error_summary = f"JSON Lint Output:\n{lint_output}"
+    if not py_ok:
+        error_summary += f"\n\nPython SyntaxError:\n{py_error_output}"
+    return False, error_summary
+
+
+def next_fix_strategy(model, full_file):
+    """
+    Returns the (model, full_file) to use after a fix that made no progress,
+    or None when there is nothing stronger left to try.
+    """
+    if model == SMALL_MODEL:
+        return LARGE_MODEL, full_file
+    if not full_file:
+        return model, True
+    return None
 
 
-def fix_json_until_valid(file_path, max_iterations=10):
+async def fix_json_until_valid(file_path, max_iterations=10, check_python=False,
+                               client=None):
     """
     Main loop:
-      1) Check if the JSON is valid (via jsonlint-php or fallback).
-      2) If not valid, also simulate a Python run to see if there's a SyntaxError.
+      1) Check if the JSON is valid (Python parser, jsonlint-php on error).
+      2) If not valid and check_python is set, also simulate a Python run to
+         see if there's a SyntaxError (small files only).
       3) Send errors + file content to OpenAI for a fix suggestion.
       4) Apply the fix. Repeat until valid or out of iterations.
       5) When valid, print the final JSON content for reference.
+    Fixes come from SMALL_MODEL first; after ESCALATE_AFTER failed attempts,
+    or as soon as one of its fixes makes no progress, LARGE_MODEL takes over.
+    Prompts carry only the lines around the error and ask for a regex fix;
+    the whole file is sent after FULL_FILE_AFTER failed attempts, or when
+    LARGE_MODEL's regex fix makes no progress either.
+    The content hash of every state is tracked: a fix that leaves the content
+    unchanged counts as no progress, and returning to an earlier state stops
+    the loop.
+    The file is read once; after that each fix hands back the new content.
+    File I/O and the checks run in worker threads so that several files
+    can be fixed concurrently on one event loop.
+    A client is created for the call unless one is passed in.
     """
-    for iteration in range(1, max_iterations + 1):
-        print(f"\n--- Iteration {iteration} ---")
+    if client is None:
+        async with create_client() as client:
+            return await fix_json_until_valid(
+                file_path, max_iterations, check_python, client
+            )
 
-        is_valid, lint_output = run_jsonlint(file_path)
-        if is_valid:
-            print("[✓] JSON is valid. Script finished.")
+    current_content = await asyncio.to_thread(read_file, file_path)
+    seen_hashes = set()
+    prev_hash = None
+    model = SMALL_MODEL
+    full_file = False
+    attempts = 0
+    last_model = None
 
-            # Print final JSON content
-            with open(file_path, "r") as f:
-                final_content = f.read()
-            print("\n[Final Fixed JSON Content]:\n", final_content)
-            return
+    for iteration in range(1, max_iterations + 1):
+        log.info("\n--- %s: Iteration %d ---", file_path, iteration)
+
+        content_hash = content_hash_of(current_content)
 
-        # There's some error
-        print("[Debug] JSON Lint Output:\n", lint_output)
+        if content_hash == prev_hash:
+            # The last fix was not applied or rewrote the same content;
+            # asking the same way again would return the same cached fix
+            strategy = next_fix_strategy(model, full_file)
+            if strategy is None:
+                log.warning("[!] %s: No fix made progress. Stopping to avoid infinite loop.",
+                            file_path)
+                return
+            model, full_file = strategy
+            log.debug("%s: No progress, retrying with %s%s.", file_path, model,
+                      " and the whole file" if full_file else "")
+        else:
+            if content_hash in seen_hashes:
+                log.warning("[!] %s: Cycle detected, the file is back to an earlier state. "
+                            "Stopping.", file_path)
+                return
+            seen_hashes.add(content_hash)
+            prev_hash = content_hash
 
-        py_ok, py_error_output = simulate_python_execution(file_path)
-        if not py_ok:
-            print("[Debug] Python SyntaxError:\n", py_error_output)
+            is_valid, error_summary = await asyncio.to_thread(
+                collect_errors, file_path, current_content, check_python
+            )
+            if is_valid:
+                if last_model:
+                    log.info("[✓] %s: JSON is valid (fixed by %s). Script finished.",
+                             file_path, last_model)
+                else:
+                    log.info("[✓] %s: JSON is valid. Script finished.", file_path)
 
-        # Combine error summary
-        error_summary = f"JSON Lint Output:\n{lint_output}"
-        if not py_ok:
-            error_summary += f"\n\nPython SyntaxError:\n{py_error_output}"
+                # Print final JSON content
+                log.info("\n[Final Fixed JSON Content]:\n%s", current_content)
+                return
 
-        # Read current content
-        with open(file_path, "r") as f:
-            current_content = f.read()
+        # Every fix requested so far has left the file invalid
+        if model == SMALL_MODEL and attempts >= ESCALATE_AFTER:
+            log.debug("%s: %d failed attempts, escalating to %s.",
+                      file_path, attempts, LARGE_MODEL)
+            model = LARGE_MODEL
+        if not full_file and attempts >= FULL_FILE_AFTER:
+            log.debug("%s: %d failed attempts, sending the whole file.",
+                      file_path, attempts)
+            full_file = True
 
         # Ask OpenAI for fix
-        fix_suggestion = call_openai_for_fix(error_summary, current_content)
+        key = fix_cache_key(error_summary, content_hash, model, full_file)
+        fix_suggestion = await call_openai_for_fix(
+            client, error_summary, current_content, model=model, full_file=full_file, key=key
+        )
+        last_model = model
+        attempts += 1
 
-        # Apply the fix
-        changed = apply_fix_to_file(fix_suggestion, file_path)
-        if not changed:
-            print("[!] No fix was applied. Stopping to avoid infinite loop.")
-            return
+        # Apply the fix; the next iteration's hash shows whether it changed anything
+        _, current_content = await asyncio.to_thread(
+            apply_fix_to_file, fix_suggestion, file_path, current_content
+        )
 
-    print("[!] Reached maximum iterations. JSON may still be invalid.")
+    log.warning("[!] %s: Reached maximum iterations. JSON may still be invalid.", file_path)
     # Optionally show the last state of the file
-    with open(file_path, "r") as f:
-        final_content = f.read()
-    print("\n[Final File State After Max Iterations]:\n", final_content)
+    log.info("\n[Final File State After Max Iterations]:\n%s", current_content)
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <path_to_json_file>")
-        sys.exit(1)
+async def fix_all_until_valid(file_paths, max_iterations=10, concurrency=16,
+                              check_python=False, client=None):
+    """
+    Runs fix_json_until_valid for every file concurrently, with at most
+    `concurrency` files in flight at a time. A file that fails (API error,
+    unreadable or unwritable file) is reported and doesn't stop the others.
+    All files share one client, created here unless one is passed in.
+    """
+    if client is None:
+        async with create_client() as client:
+            return await fix_all_until_valid(
+                file_paths, max_iterations, concurrency, check_python, client
+            )
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fix_one(file_path):
+        async with semaphore:
+            try:
+                await fix_json_until_valid(
+                    file_path, max_iterations, check_python, client
+                )
+            except Exception as e:
+                log.warning("[!] %s: Fixing failed (%s: %s).", file_path,
+                            type(e).__name__, e)
+
+    try:
+        await asyncio.gather(*(fix_one(file_path) for file_path in file_paths))
+    finally:
+        # Don't keep the contents of this run alive in the check caches
+        check_json_via_python.cache_clear()
+        _python_syntax_check.cache_clear()
+
+
+async def fix_many_until_valid(file_paths, max_iterations=10, poll_interval=30,
+                               concurrency=16, check_python=False, client=None):
+    """
+    Fixes several JSON files through the OpenAI Batch API:
+      1) Collect the errors of every invalid file.
+      2) Submit all fix prompts as a single OpenAI Batch API job.
+      3) Poll until the batch is done and apply each fix to its file.
+      4) Hand every submitted file to fix_all_until_valid to verify the
+         result and keep fixing if needed.
+    A single file goes straight to fix_json_until_valid.
+    """
+    if client is None:
+        async with create_client() as client:
+            return await fix_many_until_valid(
+                file_paths, max_iterations, poll_interval, concurrency,
+                check_python, client
+            )
+
+    if len(file_paths) == 1:
+        await fix_json_until_valid(file_paths[0], max_iterations, check_python, client)
+        return
+
+    batch_lines = []
+    batch_keys = {}
+    batch_contents = {}
+    cache_hits = []
+    for file_path in file_paths:
+        log.info("\n--- Collecting errors: %s ---", file_path)
+        try:
+            current_content = await asyncio.to_thread(read_file, file_path)
+            is_valid, error_summary = await asyncio.to_thread(
+                collect_errors, file_path, current_content, check_python
+            )
+        except Exception as e:
+            log.warning("[!] %s: Could not check the file (%s: %s). Skipping.",
+                        file_path, type(e).__name__, e)
+            continue
+        if is_valid:
+            log.info("[✓] %s is already valid JSON.", file_path)
+            continue
+
+        key = fix_cache_key(
+            error_summary, content_hash_of(current_content), SMALL_MODEL
+        )
+        cached = await asyncio.to_thread(load_cached_fix, key)
+        if cached is not None:
+            log.debug("Using cached fix suggestion for %s.", file_path)
+            try:
+                await asyncio.to_thread(apply_fix_to_file, cached, file_path, current_content)
+            except Exception as e:
+                log.warning("[!] %s: Could not apply the cached fix (%s: %s).",
+                            file_path, type(e).__name__, e)
+            cache_hits.append(file_path)
+            continue
+
+        messages, max_tokens = build_fix_request(error_summary, current_content)
+        batch_keys[file_path] = key
+        batch_contents[file_path] = current_content
+        batch_lines.append(json.dumps({
+            "custom_id": file_path,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": SMALL_MODEL,
+                "messages": messages,
+                "temperature": 0.2,
+                "max_tokens": max_tokens,
+                "response_format": {"type": "json_object"},
+            },
+        }))
+
+    if not batch_lines:
+        if cache_hits:
+            await fix_all_until_valid(
+                cache_hits, max_iterations - 1, concurrency, check_python, client
+            )
+        else:
+            log.info("[✓] All files are valid JSON. Script finished.")
+        return
+
+    batch_input = await client.files.create(
+        file=("json_fixes.jsonl", "\n".join(batch_lines).encode("utf-8")),
+        purpose="batch",
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_input.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    log.info("Submitted batch %s with %d request(s).", batch.id, len(batch_lines))
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+        log.debug("Batch %s status: %s", batch.id, batch.status)
+
+    pending = [json.loads(line)["custom_id"] for line in batch_lines]
+    if batch.status == "completed" and batch.output_file_id:
+        output = (await client.files.content(batch.output_file_id)).text
+        for line in output.splitlines():
+            result = json.loads(line)
+            file_path = result["custom_id"]
+            response = result.get("response")
+            if not response or response.get("status_code") != 200:
+                log.warning("[!] Batch request failed for %s: %s",
+                            file_path, result.get("error"))
+                continue
+
+            choice = response["body"]["choices"][0]
+            fix_suggestion = strip_markdown_fences(choice["message"]["content"])
+            finish_reason = choice.get("finish_reason")
+            if finish_reason == "length":
+                log.warning("[!] Batch response for %s was cut off at the max_tokens limit.",
+                            file_path)
+            if is_cacheable_fix(fix_suggestion, finish_reason):
+                await asyncio.to_thread(
+                    store_cached_fix, batch_keys[file_path], fix_suggestion
+                )
+            log.info("\n--- Applying batch fix: %s ---", file_path)
+            try:
+                await asyncio.to_thread(
+                    apply_fix_to_file, fix_suggestion, file_path, batch_contents[file_path]
+                )
+            except Exception as e:
+                log.warning("[!] %s: Could not apply the batch fix (%s: %s).",
+                            file_path, type(e).__name__, e)
+    else:
+        log.warning("[!] Batch %s ended with status '%s'. Falling back to per-file fixing.",
+                    batch.id, batch.status)
+
+    # The batch (or cache) round counts as the first iteration
+    await fix_all_until_valid(
+        cache_hits + pending, max_iterations - 1, concurrency, check_python, client
+    )
+
+
+def collect_json_files(paths):
+    """
+    Expands the command line arguments into a list of JSON files.
+    Directories contribute their *.json files; glob patterns are expanded.
+    """
+    file_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        elif os.path.exists(path):
+            file_paths.append(path)
+        else:
+            matches = sorted(glob.glob(path))
+            if not matches:
+                log.warning("[!] File not found: %s", path)
+            file_paths.extend(matches)
+    # Batch requests are keyed by path, so each file may only appear once
+    return list(dict.fromkeys(file_paths))
 
-    json_file_path = sys.argv[1]
-    if not os.path.exists(json_file_path):
-        print(f"[!] File not found: {json_file_path}")
+
+async def main(args):
+    json_file_paths = collect_json_files(args.paths)
+    if not json_file_paths:
+        log.error("[!] No JSON files to fix.")
         sys.exit(1)
 
-    fix_json_until_valid(json_file_path)
+    async with create_client() as client:
+        if args.batch:
+            await fix_many_until_valid(
+                json_file_paths, args.max_iterations, concurrency=args.concurrency,
+                check_python=args.also_check_python, client=client,
+            )
+        else:
+            await fix_all_until_valid(
+                json_file_paths, args.max_iterations, args.concurrency,
+                args.also_check_python, client,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fix broken JSON files with the help of an LLM."
+    )
+    parser.add_argument(
+        "paths", nargs="+",
+        help="JSON files, directories of *.json files, or glob patterns",
+    )
+    parser.add_argument(
+        "--batch", action="store_true",
+        help="submit the first round of fixes through the OpenAI Batch API",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16,
+        help="maximum number of files fixed at the same time (default: 16)",
+    )
+    parser.add_argument(
+        "--max-iterations", type=int, default=10,
+        help="maximum fix attempts per file (default: 10)",
+    )
+    parser.add_argument(
+        "--also-check-python", action="store_true",
+        help="also report Python SyntaxErrors (as if the file were run as Python)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="don't read or write the on-disk fix suggestion cache",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="show debug output (prompts, LLM responses, check results)",
+    )
+
+    cli_args = parser.parse_args()
+    if cli_args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    # Configure this script's logger only; library loggers (httpx logs every
+    # request at INFO) keep the root logger's default WARNING level
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_CliFormatter("%(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG if cli_args.verbose else logging.INFO)
+    log.propagate = False
+    if cli_args.no_cache:
+        _cache_dir = None
+
+    asyncio.run(main(cli_args))